@@ -5,6 +5,7 @@ Accept request from other controllers in the cluster to send email. The service
 originates out of the cluster therefore authentication is no needed.
 """
 
+import importlib
 import os
 import logging
 from datetime import datetime, timedelta
@@ -14,70 +15,88 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from smtplib import SMTP
 
-import requests
-import coloredlogs
-from tabulate import tabulate
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, current_app, jsonify, request
 
-app = Flask(__name__)  # pylint: disable=invalid-name
-
-coloredlogs.install(level=logging.INFO)
 logger = logging.getLogger('a01.svc.email')  # pylint: disable=invalid-name
+api = Blueprint('api', __name__)  # pylint: disable=invalid-name
 
-INTERNAL_COMMUNICATION_KEY = os.environ['A01_INTERNAL_COMKEY']
-SMTP_SERVER = os.environ['A01_REPORT_SMTP_SERVER']
-SMTP_USER = os.environ['A01_REPORT_SENDER_ADDRESS']
-SMTP_PASS = os.environ['A01_REPORT_SENDER_PASSWORD']
-STORE_HOST = os.environ.get('A01_STORE_NAME', 'task-store-web-service-internal')
+# The settings which must be present, mapped to the environment variables they are read from.
+REQUIRED_SETTINGS = {'A01_INTERNAL_COMKEY': 'A01_INTERNAL_COMKEY',
+                     'SMTP_SERVER': 'A01_REPORT_SMTP_SERVER',
+                     'SMTP_USER': 'A01_REPORT_SENDER_ADDRESS',
+                     'SMTP_PASS': 'A01_REPORT_SENDER_PASSWORD'}
 
 
 class InternalAuth(object):  # pylint: disable=too-few-public-methods
+    def __init__(self, key: str):
+        self._key = key
+
     def __call__(self, req):
-        req.headers['Authorization'] = INTERNAL_COMMUNICATION_KEY
+        req.headers['Authorization'] = self._key
         return req
 
 
-SESSION = requests.Session()
-SESSION.auth = InternalAuth()
+def get_session():
+    """Return the session used to talk to the task store. It is created on first use."""
+    if 'a01_session' not in current_app.extensions:
+        import requests
+        session = requests.Session()
+        session.auth = InternalAuth(current_app.config['A01_INTERNAL_COMKEY'])
+        current_app.extensions['a01_session'] = session
 
+    return current_app.extensions['a01_session']
 
-def get_task_store_uri(path: str) -> str:
-    # in debug mode, the service is likely run out of a cluster, switch to https schema
-    if app.debug:
-        return f'https://{STORE_HOST}/api/{path}'
-    return f'http://{STORE_HOST}/api/{path}'
 
+def is_new_failure(change: dict) -> bool:
+    """Return true if a task of the run comparison failed in the run but not in the base run, including a test added
+    since the base run."""
+    if change['change'] == 'new':
+        return change['result'] not in ('Passed', None)
+    return change['change'] == 'failing'
 
-@app.route('/health')
-def healthy():
-    status = 'healthy'
-    remark = ''
 
-    if not SMTP_SERVER or not SMTP_USER or not SMTP_PASS:
-        logger.error('missing environment variable to setup email service.')
-        status = 'unhealthy'
-        remark = 'missing SMTP settings'
+def get_task_store_uri(path: str) -> str:
+    store_host = current_app.config['STORE_HOST']
+    # in debug mode, the service is likely run out of a cluster, switch to https schema
+    if current_app.debug:
+        return f'https://{store_host}/api/{path}'
+    return f'http://{store_host}/api/{path}'
 
-    if not INTERNAL_COMMUNICATION_KEY:
-        logger.error('missing internal communication key')
-        status = 'unhealthy'
-        remark = 'missing internal communication key'
 
-    return jsonify({'status': status, 'time': datetime.utcnow(), 'remark': remark})
+@api.route('/health')
+def healthy():
+    """Healthy status endpoint. The SMTP settings and the internal communication key are checked by create_app."""
+    return jsonify({'status': 'healthy', 'time': datetime.utcnow(), 'remark': ''})
 
 
-@app.route('/report', methods=['POST'])
+@api.route('/report', methods=['POST'])
 def send_report():
+    from tabulate import tabulate
+
     logger.info('requested to send email')
     run_id = request.json['run_id']
     receivers = request.json['receivers']
     logger.info(f'run: {run_id} | receivers: {receivers}')
 
-    run = SESSION.get(get_task_store_uri(f'run/{run_id}')).json()
-    tasks = sorted(SESSION.get(get_task_store_uri(f'run/{run_id}/tasks')).json(), key=lambda t: t['status'])
+    session = get_session()
+    run = session.get(get_task_store_uri(f'run/{run_id}')).json()
+    tasks = sorted(session.get(get_task_store_uri(f'run/{run_id}/tasks')).json(), key=lambda t: t['status'])
 
     logger.info(f'successfully read run {run_id}.')
 
+    # the comparison is not available for the first run of an owner
+    new_failures_section = ''
+    comparison = session.get(get_task_store_uri(f'run/{run_id}/compare'))
+    if comparison.status_code == 200:
+        comparison = comparison.json()
+        new_failures = [(t['name'].rsplit('.')[-1], t['base_result'], t['result'])
+                        for t in comparison['tasks'] if is_new_failure(t)]
+        new_failures_section = f"""\
+            <div>
+                <h2>New failures since run {comparison['base_run_id']}</h2>
+                {tabulate(new_failures, headers=("name", "previous result", "result"), tablefmt="html")}
+            </div>"""
+
     statuses = defaultdict(lambda: 0)
     results = defaultdict(lambda: 0)
 
@@ -130,6 +149,7 @@ def send_report():
                 <h2>Summary</h2>
                 {tabulate(summaries, tablefmt="html")}
             </div>
+{new_failures_section}
             <div>
                 <h2>Failures</h2>
                 {tabulate(failure, headers=("id", "name", "status", "result", "duration(ms)", "module"), tablefmt="html")}
@@ -149,14 +169,49 @@ def send_report():
 
     mail = MIMEMultipart()
     mail['Subject'] = f'Azure CLI Automation Run {str(creation)} - {result_summary}.'
-    mail['From'] = SMTP_USER
+    mail['From'] = current_app.config['SMTP_USER']
     mail['To'] = receivers
     mail.attach(MIMEText(content, 'html'))
 
     logger.info('sending emails.')
-    with SMTP(SMTP_SERVER) as server:
+    with SMTP(current_app.config['SMTP_SERVER']) as server:
         server.starttls()
-        server.login(SMTP_USER, SMTP_PASS)
+        server.login(current_app.config['SMTP_USER'], current_app.config['SMTP_PASS'])
         server.send_message(mail)
 
     return jsonify({'status': 'done'})
+
+
+def create_app(config: dict = None) -> Flask:
+    """Create the email application.
+
+    The settings are read from the environment variables and can be overridden by the given config. The HTTP session and
+    the report renderer are loaded on first use, call warm_up to load them ahead of the first request.
+    """
+    import coloredlogs
+    coloredlogs.install(level=logging.INFO)
+
+    app = Flask(__name__)
+    app.config.update({
+        'A01_INTERNAL_COMKEY': os.environ.get('A01_INTERNAL_COMKEY'),
+        'SMTP_SERVER': os.environ.get('A01_REPORT_SMTP_SERVER'),
+        'SMTP_USER': os.environ.get('A01_REPORT_SENDER_ADDRESS'),
+        'SMTP_PASS': os.environ.get('A01_REPORT_SENDER_PASSWORD'),
+        'STORE_HOST': os.environ.get('A01_STORE_NAME', 'task-store-web-service-internal'),
+    })
+    app.config.update(config or {})
+    for setting, variable in REQUIRED_SETTINGS.items():
+        if not app.config.get(setting):
+            raise KeyError(f'The setting {variable} is missing.')
+
+    app.register_blueprint(api)
+
+    return app
+
+
+def warm_up(app: Flask) -> None:
+    """Load the modules and the resources needed by the first request so it is not paid by a client."""
+    importlib.import_module('tabulate')
+
+    with app.app_context():
+        get_session()
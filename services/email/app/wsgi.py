@@ -0,0 +1,8 @@
+"""
+The entry point of the uWSGI server. The application is created and warmed up once in the master process before the
+workers are forked.
+"""
+from main import create_app, warm_up
+
+app = create_app()  # pylint: disable=invalid-name
+warm_up(app)
@@ -0,0 +1,186 @@
+"""
+Bulk export of the runs and their tasks to NDJSON or Parquet files for offline analysis. The rows are read from the
+database in batches so the memory use is bounded regardless of the size of the export.
+"""
+import json
+import os
+from datetime import datetime
+from typing import Iterator, List
+
+from sqlalchemy import select
+
+from main import Run, SafeRevision, Task
+
+RUN_COLUMNS = ['id', 'name', 'owner', 'status', 'creation', 'settings', 'details', 'revision']
+TASK_COLUMNS = ['id', 'run_id', 'name', 'annotation', 'status', 'result', 'duration', 'settings', 'result_details',
+                'revision']
+
+
+class NDJSONWriter(object):
+    extension = 'ndjson'
+
+    def __init__(self, path: str, columns: List[str]):
+        self._columns = columns
+        self._file = open(path, 'w')
+
+    def write(self, rows: List[dict]) -> None:
+        for row in rows:
+            record = {column: row[column] for column in self._columns}
+            if isinstance(record.get('creation'), datetime):
+                record['creation'] = record['creation'].strftime('%Y-%m-%dT%H:%M:%SZ')
+            self._file.write(json.dumps(record) + '\n')
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetWriter(object):
+    extension = 'parquet'
+
+    def __init__(self, path: str, columns: List[str]):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError('The pyarrow package is required to export Parquet files.')
+
+        types = {'id': pyarrow.int64(), 'run_id': pyarrow.int64(), 'duration': pyarrow.int64(),
+                 'revision': pyarrow.int64(), 'creation': pyarrow.timestamp('us')}
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema([pyarrow.field(c, types.get(c, pyarrow.string())) for c in columns])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, rows: List[dict]) -> None:
+        data = {field.name: [row[field.name] for row in rows] for field in self._schema}
+        self._writer.write_table(self._pyarrow.Table.from_pydict(data, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+WRITERS = {'ndjson': NDJSONWriter, 'parquet': ParquetWriter}
+
+
+def _product(run: dict):
+    try:
+        return json.loads(run['details'] or '{}').get('a01.reserved.product')
+    except (json.JSONDecodeError, AttributeError):
+        return None
+
+
+def _changed(revision: int, after: int = None, until: int = None) -> bool:
+    return (after is None or revision > after) and (until is None or revision <= until)
+
+
+def _read_checkpoint(checkpoint: str, filters: dict):
+    """Return the revision recorded by the checkpoint file, or None if the file does not exist yet."""
+    if not os.path.exists(checkpoint):
+        return None
+
+    with open(checkpoint, 'r') as handle:
+        state = json.load(handle)
+
+    # the rows excluded by other filters were not exported, they would be skipped for good once the checkpoint advances
+    if state.get('filters') != filters:
+        raise ValueError(f'The checkpoint {checkpoint} was recorded with the filters {state.get("filters")}, which '
+                         f'differ from {filters}. Use a separate checkpoint file for each set of filters.')
+    return state['revision']
+
+
+def iter_runs(connection, batch_size: int, since: datetime = None, until: datetime = None,
+              owner: str = None) -> Iterator[List[dict]]:
+    """Yield the runs in batches ordered by id."""
+    table = Run.__table__
+    last_id = 0
+    while True:
+        query = select([table]).where(table.c.id > last_id)
+        if since:
+            query = query.where(table.c.creation >= since)
+        if until:
+            query = query.where(table.c.creation < until)
+        if owner:
+            query = query.where(table.c.owner == owner)
+
+        rows = [dict(row) for row in connection.execute(query.order_by(table.c.id).limit(batch_size))]
+        if not rows:
+            return
+
+        yield rows
+        last_id = rows[-1]['id']
+
+
+def iter_tasks(connection, run_ids: List[int], batch_size: int, after: int = None,
+               until: int = None) -> Iterator[List[dict]]:
+    """Yield the tasks of the given runs changed within the revisions (after, until] in batches. They are read by a
+    single query through a server-side cursor."""
+    table = Task.__table__
+    query = select([table]).where(table.c.run_id.in_(run_ids))
+    if after is not None:
+        query = query.where(table.c.revision > after)
+    if until is not None:
+        query = query.where(table.c.revision <= until)
+
+    result = connection.execution_options(stream_results=True).execute(query)
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                return
+
+            yield [dict(row) for row in rows]
+    finally:
+        result.close()
+
+
+def export(engine, output_dir: str, output_format: str = 'ndjson',  # pylint: disable=too-many-arguments
+           batch_size: int = 1000, checkpoint: str = None, since: datetime = None, until: datetime = None,
+           owner: str = None, product: str = None) -> dict:
+    """Export the runs and their tasks into a pair of files in the output directory.
+
+    When a checkpoint file is given, only the runs and the tasks changed since the previous export are exported, and the
+    checkpoint is advanced once the export completes. A run still in progress is exported again as it changes, the
+    row with the highest revision is the latest. The checkpoint records the filters and can only be resumed with the
+    same filters. Returns the number of runs and tasks exported.
+    """
+    filters = {'since': since.isoformat() if since else None,
+               'until': until.isoformat() if until else None,
+               'owner': owner,
+               'product': product}
+    after = _read_checkpoint(checkpoint, filters) if checkpoint else None
+
+    writer_type = WRITERS[output_format]
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    os.makedirs(output_dir, exist_ok=True)
+    runs_writer = writer_type(os.path.join(output_dir, f'runs-{stamp}.{writer_type.extension}'), RUN_COLUMNS)
+    tasks_writer = writer_type(os.path.join(output_dir, f'tasks-{stamp}.{writer_type.extension}'), TASK_COLUMNS)
+
+    summary = {'runs': 0, 'tasks': 0, 'revision': None}
+    try:
+        with engine.connect() as connection:
+            # the writes up to this revision are all finished, the later ones are left to the next export
+            if checkpoint:
+                summary['revision'] = max(after or 0, connection.execute(select([SafeRevision()])).scalar())
+
+            for runs in iter_runs(connection, batch_size, since=since, until=until, owner=owner):
+                if product:
+                    runs = [run for run in runs if _product(run) == product]
+                if not runs:
+                    continue
+
+                changed = [run for run in runs if _changed(run['revision'], after, summary['revision'])]
+                runs_writer.write(changed)
+                summary['runs'] += len(changed)
+
+                for tasks in iter_tasks(connection, [run['id'] for run in runs], batch_size, after=after,
+                                        until=summary['revision']):
+                    tasks_writer.write(tasks)
+                    summary['tasks'] += len(tasks)
+    finally:
+        runs_writer.close()
+        tasks_writer.close()
+
+    if checkpoint:
+        with open(checkpoint, 'w') as handle:
+            json.dump({'revision': summary['revision'], 'filters': filters}, handle)
+
+    return summary
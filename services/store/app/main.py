@@ -6,30 +6,98 @@ relationship meaning the driver is the consumer (A01Droid).
 """
 from datetime import datetime, timedelta
 import base64
+import importlib
 import logging
 import os
 import json
+import random
+import re
+import time
 from functools import wraps
-from packaging import version
 
-import coloredlogs
-from flask import Flask, jsonify, request, Response
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask import Blueprint, Flask, Response, current_app, has_request_context, jsonify, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import BigInteger, and_, func, or_, orm
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 
-import jwt
-import requests
-from cryptography.x509 import load_pem_x509_certificate
-from cryptography.hazmat.backends import default_backend
+# The settings which must be present, mapped to the environment variables they are read from.
+REQUIRED_SETTINGS = {'SQLALCHEMY_DATABASE_URI': 'A01_DATABASE_URI', 'A01_INTERNAL_COMKEY': 'A01_INTERNAL_COMKEY'}
 
-coloredlogs.install(level=logging.INFO)
 
-app = Flask(__name__)  # pylint: disable=invalid-name
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['A01_DATABASE_URI']
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)  # pylint: disable=invalid-name
-migrate = Migrate(app, db)  # pylint: disable=invalid-name
-INTERNAL_COMMUNICATION_KEY = os.environ['A01_INTERNAL_COMKEY']
+def _env_int(name: str, default: int = None):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_bool(name: str) -> bool:
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def _config_from_environment() -> dict:
+    return {
+        'SQLALCHEMY_DATABASE_URI': os.environ.get('A01_DATABASE_URI'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SQLALCHEMY_POOL_SIZE': _env_int('A01_DATABASE_POOL_SIZE'),
+        'SQLALCHEMY_MAX_OVERFLOW': _env_int('A01_DATABASE_MAX_OVERFLOW'),
+        'SQLALCHEMY_POOL_TIMEOUT': _env_int('A01_DATABASE_POOL_TIMEOUT'),
+        'SQLALCHEMY_POOL_RECYCLE': _env_int('A01_DATABASE_POOL_RECYCLE'),
+        'A01_DATABASE_POOL_PRE_PING': _env_bool('A01_DATABASE_POOL_PRE_PING'),
+        # A01_DATABASE_READ_URI accepts one or more read replicas separated by commas or whitespaces
+        'A01_DATABASE_READ_URIS': [u for u in re.split(r'[\s,]+', os.environ.get('A01_DATABASE_READ_URI', '')) if u],
+        'A01_DATABASE_READ_STICKY_SECONDS': _env_int('A01_DATABASE_READ_STICKY_SECONDS', 10),
+        'A01_INTERNAL_COMKEY': os.environ.get('A01_INTERNAL_COMKEY'),
+    }
+
+
+# A write response carries its time in this cookie and header. A client which sends it back within the sticky window
+# reads from the primary database so it sees its own writes regardless of the replication lag. The state is kept by the
+# client because its requests are spread over the worker processes and the pods.
+LAST_WRITE_COOKIE = 'a01_last_write'
+LAST_WRITE_HEADER = 'X-A01-Last-Write'
+
+
+def use_replica() -> bool:
+    """Return true if the queries of the current request can be served by a read replica."""
+    if not current_app.config['A01_DATABASE_READ_BINDS'] or request.method not in ('GET', 'HEAD'):
+        return False
+
+    last_write = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return time.time() - float(last_write) >= current_app.config['A01_DATABASE_READ_STICKY_SECONDS']
+    except (TypeError, ValueError):
+        return True
+
+
+class RoutingSession(SignallingSession):  # pylint: disable=too-many-ancestors
+    def __init__(self, *args, **kwargs):
+        super(RoutingSession, self).__init__(*args, **kwargs)
+        # a request reads from a single replica so its queries see the same state
+        self._replica = None
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context() and not self._flushing and use_replica():
+            if self._replica is None:
+                self._replica = random.choice(self.app.config['A01_DATABASE_READ_BINDS'])
+            return self.app.extensions['sqlalchemy'].db.get_engine(self.app, bind=self._replica)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension which sends the reads of GET requests to the replicas and honors the pool pre-ping
+    setting."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        if app.config['A01_DATABASE_POOL_PRE_PING']:
+            options['pool_pre_ping'] = True
+        return super(RoutingSQLAlchemy, self).apply_driver_hacks(app, info, options)
+
+
+db = RoutingSQLAlchemy()  # pylint: disable=invalid-name
+api = Blueprint('api', __name__)  # pylint: disable=invalid-name
 
 
 def _unify_json_input(data):
@@ -52,6 +120,51 @@ def _unify_json_output(data):
         return data
 
 
+class NextRevision(FunctionElement):  # pylint: disable=too-many-ancestors
+    """The revision stamped on the runs and the tasks written by the current transaction.
+
+    On PostgreSQL it is the id of the transaction, which only grows. Since a transaction can commit after a younger one,
+    a reader must not go beyond the SafeRevision. Other databases, used by the tests and the benchmark, serialize the
+    writes, so a counter over both tables is enough.
+    """
+    type = BigInteger()
+    name = 'next_revision'
+
+
+class SafeRevision(FunctionElement):  # pylint: disable=too-many-ancestors
+    """The highest revision such that every write stamped with it or below is committed or rolled back."""
+    type = BigInteger()
+    name = 'safe_revision'
+
+
+@compiles(NextRevision, 'postgresql')
+def _compile_next_revision_postgresql(element, compiler, **kwargs):  # pylint: disable=unused-argument
+    return 'txid_current()'
+
+
+@compiles(NextRevision)
+def _compile_next_revision(element, compiler, **kwargs):  # pylint: disable=unused-argument
+    return '(SELECT COALESCE(MAX(revision), 0) + 1 FROM (SELECT revision FROM run UNION ALL SELECT revision FROM task))'
+
+
+@compiles(SafeRevision, 'postgresql')
+def _compile_safe_revision_postgresql(element, compiler, **kwargs):  # pylint: disable=unused-argument
+    # the transactions older than the oldest one in flight are all finished
+    return 'txid_snapshot_xmin(txid_current_snapshot()) - 1'
+
+
+@compiles(SafeRevision)
+def _compile_safe_revision(element, compiler, **kwargs):  # pylint: disable=unused-argument
+    return '(SELECT COALESCE(MAX(revision), 0) FROM (SELECT revision FROM run UNION ALL SELECT revision FROM task))'
+
+
+def _changed_since() -> tuple:
+    """Return the revision given by the since query parameter and the revision to ask from next time. Raise ValueError
+    if the since query parameter is not a revision."""
+    since = int(request.args['since'])
+    return since, max(since, db.session.query(SafeRevision()).scalar())
+
+
 class Run(db.Model):
     # unique id
     id = db.Column(db.Integer, primary_key=True)
@@ -82,6 +195,9 @@ class Run(db.Model):
     # Completed.
     status = db.Column(db.String)
 
+    # The revision of the last change of this run
+    revision = db.Column(db.BigInteger, default=NextRevision(), onupdate=NextRevision(), index=True)
+
     def digest(self):
         """Return an serializable object for REST API"""
         result = {
@@ -89,6 +205,7 @@ class Run(db.Model):
             'name': self.name,
             'owner': self.owner,
             'status': self.status,
+            'revision': self.revision,
             'creation': self.creation.strftime('%Y-%m-%dT%H:%M:%SZ'),
             'details': _unify_json_output(self.details),
             'settings': _unify_json_output(self.settings)
@@ -136,12 +253,23 @@ class Task(db.Model):
     result = db.Column(db.String)
     # the duration of the test run in milliseconds
     duration = db.Column(db.Integer)
+    # the revision of the last change of this task
+    revision = db.Column(db.BigInteger, default=NextRevision(), onupdate=NextRevision())
 
     # relationship
     run_id = db.Column(db.Integer, db.ForeignKey('run.id'), nullable=False)
     run = db.relationship('Run', backref=db.backref('tasks', cascade='all, delete-orphan', lazy=True))
 
-    immutable_properties = {'name', 'id', 'annotation', 'run_id'}
+    # indices serving the history of a test across the runs. the run id grows with the run creation, so the rows of a
+    # name or an annotation are read in the order of the runs. the text_pattern_ops allows name prefix search. the
+    # (run_id, name) index serves the listing of the tasks of a run and the comparison of runs. the (run_id, revision)
+    # index serves the listing of the tasks changed since a revision.
+    __table_args__ = (db.Index('ix_task_name_run_id', 'name', 'run_id', postgresql_ops={'name': 'text_pattern_ops'}),
+                      db.Index('ix_task_annotation_run_id', 'annotation', 'run_id'),
+                      db.Index('ix_task_run_id_name', 'run_id', 'name'),
+                      db.Index('ix_task_run_id_revision', 'run_id', 'revision'))
+
+    immutable_properties = {'name', 'id', 'annotation', 'run_id', 'revision'}
 
     def digest(self) -> dict:
         result = {
@@ -153,7 +281,8 @@ class Task(db.Model):
             'duration': self.duration,
             'result': self.result,
             'result_details': _unify_json_output(self.result_details),
-            'run_id': self.run_id
+            'run_id': self.run_id,
+            'revision': self.revision
         }
 
         return result
@@ -201,6 +330,10 @@ class AzureADPublicKeysManager(object):
             self._logger.info('Skip refreshing the certificates')
 
     def _update_certs(self) -> None:
+        import requests
+        from cryptography.x509 import load_pem_x509_certificate
+        from cryptography.hazmat.backends import default_backend
+
         self._certs.clear()
         response = requests.get(self._jwks_uri)
         for key in response.json()['keys']:
@@ -210,11 +343,17 @@ class AzureADPublicKeysManager(object):
             self._logger.info('Create public key for %s from cert: %s', key['kid'], cert_str)
             self._certs[key['kid']] = public_key
 
+    def prefetch(self) -> None:
+        """Fetch the signing keys ahead of the first authentication."""
+        self._refresh_certs()
+
     def get_public_key(self, key_id: str):
         self._refresh_certs()
         return self._certs[key_id]
 
     def get_id_token_payload(self, id_token: str):
+        import jwt
+
         header = json.loads(base64.b64decode(id_token.split('.')[0]).decode('utf-8'))
         key_id = header['kid']
         public_key = self.get_public_key(key_id)
@@ -222,20 +361,19 @@ class AzureADPublicKeysManager(object):
         return jwt.decode(id_token, public_key, audience=self._client_id)
 
 
-jwt_auth = AzureADPublicKeysManager()  # pylint: disable=invalid-name
-
-
 def auth(fn):  # pylint: disable=invalid-name
     @wraps(fn)
     def _wrapper(*args, **kwargs):
         try:
             jwt_raw = request.environ['HTTP_AUTHORIZATION']
-            if jwt_raw != INTERNAL_COMMUNICATION_KEY:
-                jwt_auth.get_id_token_payload(jwt_raw)
+            if jwt_raw != current_app.config['A01_INTERNAL_COMKEY']:
+                import jwt
+                try:
+                    current_app.extensions['a01_jwt_auth'].get_id_token_payload(jwt_raw)
+                except jwt.ExpiredSignatureError:
+                    return Response(json.dumps({'error': 'Expired', 'message': 'The JWT token is expired.'}), 401)
         except KeyError:
             return Response(json.dumps({'error': 'Unauthorized', 'message': 'Missing authorization header.'}), 401)
-        except jwt.ExpiredSignatureError:
-            return Response(json.dumps({'error': 'Expired', 'message': 'The JWT token is expired.'}), 401)
         except UnicodeDecodeError:
             return jsonify({'error': 'Bad Request', 'message': 'Authorization header cannot be parsed'}), 400
 
@@ -244,17 +382,37 @@ def auth(fn):  # pylint: disable=invalid-name
     return _wrapper
 
 
-@app.route('/api/health')
-@app.route('/api/healthy')
+@api.after_request
+def record_write(response):
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        now = str(time.time())
+        response.headers[LAST_WRITE_HEADER] = now
+        response.set_cookie(LAST_WRITE_COOKIE, now, max_age=current_app.config['A01_DATABASE_READ_STICKY_SECONDS'])
+    return response
+
+
+@api.route('/api/health')
+@api.route('/api/healthy')
 def get_healthy():
     """Healthy status endpoint"""
     return jsonify({'status': 'healthy', 'time': datetime.utcnow()})
 
 
-@app.route('/api/runs')
+@api.route('/api/runs')
 @auth
 def get_runs():
     """List all the runs"""
+    if 'since' in request.args:
+        # only the runs changed after the given revision, with the revision to ask from next time
+        try:
+            since, revision = _changed_since()
+        except ValueError:
+            return jsonify({'error': 'The "since" query parameter must be a revision.'}), 400
+        query = Run.query.filter(Run.revision > since, Run.revision <= revision).order_by(Run.revision)
+        if 'owner' in request.args:
+            query = query.filter_by(owner=request.args['owner'])
+        return jsonify({'revision': revision, 'runs': [r.digest() for r in query.all()]})
+
     query = Run.query.order_by(Run.creation.desc())
     if 'owner' in request.args:
         query = query.filter_by(owner=request.args['owner'])
@@ -266,7 +424,7 @@ def get_runs():
     return jsonify([r.digest() for r in query.all()])
 
 
-@app.route('/api/run', methods=['POST'])
+@api.route('/api/run', methods=['POST'])
 @auth
 def post_run():
     data = request.json
@@ -279,6 +437,7 @@ def post_run():
         return jsonify({'error': 'The "a01.reserved.client" property is missing from the "details". The request was '
                                  'sent from an older version of client. Please upgrade your client.'}), 400
     else:
+        from packaging import version
         client_version = version.parse(data['details']['a01.reserved.client'].split(' ')[1])
         if client_version < version.parse('0.15.0'):
             return jsonify({'error': 'Minimal client requirement is "0.15.0". Please upgrade your client'}), 400
@@ -291,7 +450,7 @@ def post_run():
     return jsonify(run.digest())
 
 
-@app.route('/api/run/<run_id>', methods=['POST'])
+@api.route('/api/run/<run_id>', methods=['POST'])
 @auth
 def update_run(run_id):
     run = Run.query.filter_by(id=run_id).first_or_404()
@@ -304,14 +463,14 @@ def update_run(run_id):
     return jsonify(run.digest())
 
 
-@app.route('/api/run/<run_id>')
+@api.route('/api/run/<run_id>')
 @auth
 def get_run(run_id):
     run = Run.query.filter_by(id=run_id).first_or_404()
     return jsonify(run.digest())
 
 
-@app.route('/api/run/<run_id>', methods=['DELETE'])
+@api.route('/api/run/<run_id>', methods=['DELETE'])
 @auth
 def delete_run(run_id):
     run = Run.query.filter_by(id=run_id).first()
@@ -323,17 +482,91 @@ def delete_run(run_id):
     return jsonify({'status': 'no action'})
 
 
-@app.route('/api/run/<run_id>/tasks')
+@api.route('/api/run/<run_id>/tasks')
 @auth
 def get_tasks(run_id):
     run = Run.query.filter_by(id=run_id).first()
     if not run:
         return jsonify({'error': f'run <{run_id}> is not found'}), 404
 
+    if 'since' in request.args:
+        # only the tasks changed after the given revision, with the revision to ask from next time
+        try:
+            since, revision = _changed_since()
+        except ValueError:
+            return jsonify({'error': 'The "since" query parameter must be a revision.'}), 400
+        tasks = Task.query.filter(Task.run_id == run.id, Task.revision > since, Task.revision <= revision) \
+            .order_by(Task.revision).all()
+        return jsonify({'revision': revision, 'tasks': [t.digest() for t in tasks]})
+
     return jsonify([t.digest() for t in run.tasks])
 
 
-@app.route('/api/run/<run_id>/task', methods=['POST'])
+def _latest_tasks(run_id: int):
+    """Return a subquery of the name, result, and duration of the tests of a run. A test which appears more than once in
+    the run is represented by its latest task."""
+    latest = db.session.query(func.max(Task.id)).filter(Task.run_id == run_id).group_by(Task.name)
+    return db.session.query(Task.name, Task.result, Task.duration).filter(Task.id.in_(latest)).subquery()
+
+
+def _classify_change(base_name, name, base_result, result) -> str:
+    """Classify a test which differs between the base run and the compared run."""
+    if base_name is None:
+        return 'new'
+    if name is None:
+        return 'missing'
+    if result == base_result:
+        return 'slower'
+    if result == 'Passed':
+        return 'fixed'
+    if result is not None and base_result in ('Passed', None):
+        return 'failing'
+    return 'changed'
+
+
+@api.route('/api/run/<run_id>/compare')
+@auth
+def compare_run(run_id):
+    """Compare the task results of a run with a base run, by default the previous run of the same owner"""
+    run = Run.query.filter_by(id=run_id).first()
+    if not run:
+        return jsonify({'error': f'run <{run_id}> is not found'}), 404
+
+    if 'base' in request.args:
+        base = Run.query.filter_by(id=request.args['base']).first()
+    else:
+        base = Run.query.filter(Run.owner == run.owner, Run.id < run.id).order_by(Run.id.desc()).first()
+    if not base:
+        return jsonify({'error': f'base run of run <{run_id}> is not found'}), 404
+
+    ratio = request.args.get('duration_ratio', 2.0, type=float)
+    delta = request.args.get('duration_delta', 10000, type=int)
+
+    current = _latest_tasks(run.id)
+    previous = _latest_tasks(base.id)
+    query = db.session.query(previous.c.name, current.c.name, previous.c.result, current.c.result,
+                             previous.c.duration, current.c.duration) \
+        .select_from(current) \
+        .outerjoin(previous, current.c.name == previous.c.name, full=True) \
+        .filter(or_(current.c.name.is_(None),
+                    previous.c.name.is_(None),
+                    current.c.result.is_distinct_from(previous.c.result),
+                    and_(current.c.duration > previous.c.duration * ratio,
+                         current.c.duration - previous.c.duration > delta))) \
+        .order_by(func.coalesce(current.c.name, previous.c.name))
+
+    summary = {'failing': 0, 'fixed': 0, 'new': 0, 'missing': 0, 'changed': 0, 'slower': 0}
+    changes = []
+    for base_name, name, base_result, result, base_duration, duration in query.all():
+        change = _classify_change(base_name, name, base_result, result)
+        summary[change] += 1
+        changes.append({'name': name or base_name, 'change': change, 'base_result': base_result, 'result': result,
+                        'base_duration': base_duration, 'duration': duration})
+
+    return jsonify({'run_id': run.id, 'base_run_id': base.id, 'summary': summary, 'tasks': changes})
+
+
+@api.route('/api/run/<run_id>/task', methods=['POST'])
 @auth
 def post_task(run_id):
     run = Run.query.filter_by(id=run_id).first()
@@ -349,7 +582,7 @@ def post_task(run_id):
     return jsonify(task.digest())
 
 
-@app.route('/api/run/<run_id>/tasks', methods=['POST'])
+@api.route('/api/run/<run_id>/tasks', methods=['POST'])
 @auth
 def post_tasks(run_id):
     run = Run.query.filter_by(id=run_id).first()
@@ -366,7 +599,40 @@ def post_tasks(run_id):
     return jsonify({'status': 'success', 'added': len(request.json)})
 
 
-@app.route('/api/task/<task_id>')
+# The maximum number of results returned by a history lookup
+MAX_HISTORY = 200
+
+
+@api.route('/api/tasks/history')
+@auth
+def get_task_history():
+    """List the recent results of a test, selected by name, name prefix, or annotation, across the runs"""
+    query = db.session.query(Task.run_id, Task.name, Task.status, Task.result, Task.duration)
+    if 'name' in request.args:
+        query = query.filter(Task.name == request.args['name'])
+    elif 'prefix' in request.args:
+        query = query.filter(Task.name.startswith(request.args['prefix'], autoescape=True))
+    elif 'annotation' in request.args:
+        query = query.filter(Task.annotation == request.args['annotation'])
+    else:
+        return jsonify({'error': 'One of "name", "prefix", or "annotation" query parameter is required.'}), 400
+
+    if 'before' in request.args:
+        if not request.args['before'].isdigit():
+            return jsonify({'error': 'The "before" query parameter must be a run id.'}), 400
+        query = query.filter(Task.run_id < int(request.args['before']))
+
+    last = request.args.get('last', '20')
+    if not last.isdigit() or not 1 <= int(last) <= MAX_HISTORY:
+        return jsonify({'error': f'The "last" query parameter must be between 1 and {MAX_HISTORY}.'}), 400
+
+    query = query.order_by(Task.run_id.desc()).limit(int(last))
+
+    return jsonify([{'run_id': run_id, 'name': name, 'status': status, 'result': result, 'duration': duration}
+                    for run_id, name, status, result, duration in query.all()])
+
+
+@api.route('/api/task/<task_id>')
 @auth
 def get_task(task_id):
     task = Task.query.filter_by(id=task_id).first()
@@ -376,7 +642,7 @@ def get_task(task_id):
     return jsonify(task.digest())
 
 
-@app.route('/api/task/<task_id>', methods=['PATCH'])
+@api.route('/api/task/<task_id>', methods=['PATCH'])
 @auth
 def patch_task(task_id):
     task = Task.query.filter_by(id=task_id).first()
@@ -392,5 +658,48 @@ def patch_task(task_id):
     return jsonify(task.digest())
 
 
+def create_app(config: dict = None) -> Flask:
+    """Create the store application.
+
+    The settings are read from the environment variables and can be overridden by the given config. The heavy modules
+    and the Azure AD signing keys are loaded on first use, call warm_up to load them ahead of the first request.
+    """
+    import coloredlogs
+    coloredlogs.install(level=logging.INFO)
+
+    app = Flask(__name__)
+    app.config.update(_config_from_environment())
+    app.config.update(config or {})
+    for setting, variable in REQUIRED_SETTINGS.items():
+        if not app.config.get(setting):
+            raise KeyError(f'The setting {variable} is missing.')
+
+    read_binds = [f'replica{index}' for index in range(len(app.config['A01_DATABASE_READ_URIS']))]
+    app.config['A01_DATABASE_READ_BINDS'] = read_binds
+    app.config['SQLALCHEMY_BINDS'] = dict(zip(read_binds, app.config['A01_DATABASE_READ_URIS']))
+
+    db.init_app(app)
+    app.extensions['a01_jwt_auth'] = AzureADPublicKeysManager()
+    app.register_blueprint(api)
+
+    return app
+
+
+def warm_up(app: Flask) -> None:
+    """Load the modules and the resources needed by the first request so it is not paid by a client."""
+    for module in ('jwt', 'requests', 'cryptography.x509', 'packaging.version'):
+        importlib.import_module(module)
+
+    with app.app_context():
+        db.get_engine(app)
+        for bind in app.config['A01_DATABASE_READ_BINDS']:
+            db.get_engine(app, bind=bind)
+
+    try:
+        app.extensions['a01_jwt_auth'].prefetch()
+    except Exception:  # pylint: disable=broad-except
+        logging.getLogger(__name__).exception('Fail to fetch the signing keys. They will be fetched on first use.')
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=80, debug=True)
+    create_app().run(host='0.0.0.0', port=80, debug=True)
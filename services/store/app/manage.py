@@ -0,0 +1,54 @@
+"""
+The entry point of the Flask command line, e.g. the database migration commands of Flask-Migrate and the bulk export.
+Set FLASK_APP to this file to use it.
+"""
+from datetime import datetime
+
+import click
+from flask_migrate import Migrate
+from sqlalchemy import create_engine
+
+from export import export
+from main import create_app, db
+
+app = create_app()  # pylint: disable=invalid-name
+migrate = Migrate(app, db)  # pylint: disable=invalid-name
+
+
+def _parse_date(ctx, param, value):  # pylint: disable=unused-argument
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        raise click.BadParameter('The date must be in the form of YYYY-MM-DD.')
+
+
+# pylint: disable=too-many-arguments
+@app.cli.command('export')
+@click.option('--output-dir', '-o', required=True, help='The directory the runs and tasks files are written to.')
+@click.option('--format', 'output_format', type=click.Choice(['ndjson', 'parquet']), default='ndjson',
+              help='The format of the files. The Parquet format requires the pyarrow package.')
+@click.option('--since', callback=_parse_date, help='Export the runs created on or after this date (YYYY-MM-DD).')
+@click.option('--until', callback=_parse_date, help='Export the runs created before this date (YYYY-MM-DD).')
+@click.option('--owner', help='Export the runs of this owner.')
+@click.option('--product', help='Export the runs of this product, e.g. azurecli.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='A file recording the progress. Only the runs and tasks changed since the previous export are '
+                   'exported.')
+@click.option('--batch-size', type=int, default=1000, help='The number of rows read from the database at a time.')
+@click.option('--database-uri', help='The database to read. Default to the first read replica, or the primary database '
+                                     'if no replica is configured.')
+def export_command(output_dir, output_format, since, until, owner, product, checkpoint, batch_size, database_uri):
+    """Export the runs and their tasks to NDJSON or Parquet files."""
+    if database_uri:
+        engine = create_engine(database_uri)
+    else:
+        read_binds = app.config['A01_DATABASE_READ_BINDS']
+        engine = db.get_engine(app, bind=read_binds[0] if read_binds else None)
+
+    try:
+        summary = export(engine, output_dir, output_format=output_format, batch_size=batch_size,
+                         checkpoint=checkpoint, since=since, until=until, owner=owner, product=product)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+
+    click.echo(f'Exported {summary["runs"]} runs and {summary["tasks"]} tasks to {output_dir}.')
@@ -0,0 +1,35 @@
+"""Add the revision of the last change to the run and the task
+
+Revision ID: e7a4c0f9b6d3
+Revises: d5e2b9c4a1f7
+Create Date: 2018-03-27 11:08:52.604127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a4c0f9b6d3'
+down_revision = 'd5e2b9c4a1f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('run', sa.Column('revision', sa.BigInteger(), nullable=True))
+    op.add_column('task', sa.Column('revision', sa.BigInteger(), nullable=True))
+
+    # the existing rows are stamped with the id of this transaction, which precedes every later write
+    op.execute('UPDATE run SET revision = txid_current()')
+    op.execute('UPDATE task SET revision = txid_current()')
+
+    op.create_index(op.f('ix_run_revision'), 'run', ['revision'], unique=False)
+    op.create_index('ix_task_run_id_revision', 'task', ['run_id', 'revision'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_task_run_id_revision', table_name='task')
+    op.drop_index(op.f('ix_run_revision'), table_name='run')
+    op.drop_column('task', 'revision')
+    op.drop_column('run', 'revision')
@@ -0,0 +1,60 @@
+"""
+The scaffold shared by the tests of the store service. Every test gets an application over a fresh SQLite database in a
+temporary folder.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from main import create_app, db
+
+KEY = 'test-key'
+
+# the details a run must carry to be accepted by the store
+RUN_DETAILS = {'a01.reserved.creator': 'tester', 'a01.reserved.client': 'A01CLI 0.16.0'}
+
+
+class StoreTestCase(unittest.TestCase):
+    def settings(self) -> dict:
+        """Return the settings of the application under test. Override to add or replace settings."""
+        return {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.folder, 'store.db'),
+            'A01_INTERNAL_COMKEY': KEY,
+        }
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.app = create_app(self.settings())
+        with self.app.app_context():
+            db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+            for bind in self.app.config['A01_DATABASE_READ_BINDS']:
+                db.get_engine(self.app, bind=bind).dispose()
+        shutil.rmtree(self.folder)
+
+    def open(self, method, path, data=None, client=None, headers=None, status=200):
+        """Send a request with the internal key and assert the status code of the response."""
+        response = (client or self.client).open(path, method=method, headers=dict(headers or {}, Authorization=KEY),
+                                                content_type='application/json',
+                                                data=None if data is None else json.dumps(data))
+        self.assertEqual(response.status_code, status, response.data)
+        return response
+
+    def request(self, method, path, data=None, **kwargs):
+        """Send a request and return the JSON body of the response."""
+        return json.loads(self.open(method, path, data, **kwargs).data.decode('utf-8'))
+
+    def create_run(self, tasks: list = None, name: str = 'run', owner: str = None, **details) -> int:
+        """Create a run with the given tasks and return its id."""
+        run = self.request('POST', '/api/run', {'name': name, 'owner': owner, 'details': dict(RUN_DETAILS, **details),
+                                                'settings': {}})
+        if tasks:
+            self.request('POST', f'/api/run/{run["id"]}/tasks', tasks)
+        return run['id']
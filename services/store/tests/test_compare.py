@@ -0,0 +1,95 @@
+"""
+Verify the comparison of the task results of a run with a base run.
+
+    $ cd services/store/app && python -m unittest discover -s ../tests
+"""
+import unittest
+
+from base import StoreTestCase
+
+
+def _task(name: str, result: str = 'Passed', duration: int = 1000) -> dict:
+    return {'name': name, 'result': result, 'duration': duration}
+
+
+class TestCompare(StoreTestCase):
+    def setUp(self):
+        super(TestCompare, self).setUp()
+        self.base_id = self.create_run([_task('test_failing'),
+                                        _task('test_fixed', 'Failed'),
+                                        _task('test_changed', 'Failed'),
+                                        _task('test_unchanged'),
+                                        _task('test_missing'),
+                                        _task('test_slower'),
+                                        _task('test_slightly_slower')], owner='tester')
+        self.run_id = self.create_run([_task('test_failing', 'Failed'),
+                                       _task('test_fixed'),
+                                       _task('test_changed', 'Error'),
+                                       _task('test_unchanged'),
+                                       _task('test_new_failing', 'Failed'),
+                                       _task('test_new_passing'),
+                                       _task('test_slower', duration=15000),
+                                       _task('test_slightly_slower', duration=5000)], owner='tester')
+
+    def compare(self, query: str = '', run_id: int = None) -> dict:
+        return self.request('GET', f'/api/run/{run_id or self.run_id}/compare?{query}')
+
+    def changes(self, query: str = '', run_id: int = None) -> dict:
+        return {t['name']: t['change'] for t in self.compare(query, run_id)['tasks']}
+
+    def test_changes(self):
+        comparison = self.compare()
+        self.assertEqual((comparison['run_id'], comparison['base_run_id']), (self.run_id, self.base_id))
+        self.assertEqual({t['name']: t['change'] for t in comparison['tasks']},
+                         {'test_failing': 'failing',
+                          'test_fixed': 'fixed',
+                          'test_changed': 'changed',
+                          'test_missing': 'missing',
+                          'test_new_failing': 'new',
+                          'test_new_passing': 'new',
+                          'test_slower': 'slower'})
+        self.assertEqual(comparison['summary'],
+                         {'failing': 1, 'fixed': 1, 'new': 2, 'missing': 1, 'changed': 1, 'slower': 1})
+
+        changed = next(t for t in comparison['tasks'] if t['name'] == 'test_changed')
+        self.assertEqual((changed['base_result'], changed['result']), ('Failed', 'Error'))
+        slower = next(t for t in comparison['tasks'] if t['name'] == 'test_slower')
+        self.assertEqual((slower['base_duration'], slower['duration']), (1000, 15000))
+
+    def test_duration_thresholds(self):
+        # test_slower is 15 times slower by 14 seconds, test_slightly_slower is 5 times slower by 4 seconds
+        slower = {name for name, change in self.changes('duration_delta=1000').items() if change == 'slower'}
+        self.assertEqual(slower, {'test_slower', 'test_slightly_slower'})
+        slower = {name for name, change in self.changes('duration_ratio=10').items() if change == 'slower'}
+        self.assertEqual(slower, {'test_slower'})
+        slower = {name for name, change in self.changes('duration_ratio=20').items() if change == 'slower'}
+        self.assertEqual(slower, set())
+        slower = {name for name, change in self.changes('duration_delta=20000').items() if change == 'slower'}
+        self.assertEqual(slower, set())
+
+    def test_explicit_base(self):
+        later_id = self.create_run([_task('test_failing')], owner='tester')
+        self.assertEqual(self.compare(run_id=later_id)['base_run_id'], self.run_id)
+        self.assertEqual(self.changes(f'base={self.base_id}', later_id),
+                         {name: 'missing' for name in ('test_changed', 'test_fixed', 'test_missing', 'test_slower',
+                                                       'test_slightly_slower', 'test_unchanged')})
+
+    def test_repeated_names(self):
+        # a test repeated in a run is compared by its latest task
+        base_id = self.create_run([_task('test_dup', 'Failed'), _task('test_dup'),
+                                   _task('test_flaky'), _task('test_flaky', 'Failed')], owner='repeater')
+        run_id = self.create_run([_task('test_dup'), _task('test_flaky')], owner='repeater')
+
+        comparison = self.compare(run_id=run_id)
+        self.assertEqual(comparison['base_run_id'], base_id)
+        self.assertEqual([(t['name'], t['change']) for t in comparison['tasks']], [('test_flaky', 'fixed')])
+
+    def test_base_not_found(self):
+        first_id = self.create_run([_task('test_a')], owner='newcomer')
+        self.open('GET', f'/api/run/{first_id}/compare', status=404)
+        self.open('GET', f'/api/run/{self.run_id}/compare?base=999', status=404)
+        self.open('GET', '/api/run/999/compare', status=404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Verify the incremental bulk export of the runs and the tasks.
+
+    $ cd services/store/app && python -m unittest discover -s ../tests
+"""
+import glob
+import json
+import os
+import unittest
+from datetime import datetime
+
+from base import StoreTestCase
+from export import export
+from main import Run, db
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # pylint: disable=invalid-name
+
+
+class TestExport(StoreTestCase):
+    def setUp(self):
+        super(TestExport, self).setUp()
+        with self.app.app_context():
+            self.engine = db.get_engine(self.app)
+        self.checkpoint = os.path.join(self.folder, 'checkpoint.json')
+
+    def export(self, name: str, checkpoint: bool = True, **filters):
+        output_dir = os.path.join(self.folder, name)
+        summary = export(self.engine, output_dir, checkpoint=self.checkpoint if checkpoint else None, **filters)
+
+        def read(kind):
+            with open(glob.glob(os.path.join(output_dir, f'{kind}-*.ndjson'))[0]) as handle:
+                return [json.loads(line) for line in handle]
+
+        return summary, read('runs'), read('tasks')
+
+    def test_incremental_export(self):
+        run_id = self.create_run([{'name': 'test_a'}, {'name': 'test_b'}])
+
+        summary, runs, tasks = self.export('first')
+        self.assertEqual((summary['runs'], summary['tasks']), (1, 2))
+        self.assertEqual([r['status'] for r in runs], [None])
+        self.assertEqual(sorted(t['name'] for t in tasks), ['test_a', 'test_b'])
+
+        # the run was still in progress, its later changes are exported by the next execution
+        task_id = next(t['id'] for t in tasks if t['name'] == 'test_a')
+        self.request('PATCH', f'/api/task/{task_id}', {'result': 'Passed'})
+        self.request('POST', f'/api/run/{run_id}', {'status': 'Completed'})
+
+        summary, runs, tasks = self.export('second')
+        self.assertEqual((summary['runs'], summary['tasks']), (1, 1))
+        self.assertEqual([r['status'] for r in runs], ['Completed'])
+        self.assertEqual([(t['name'], t['result']) for t in tasks], [('test_a', 'Passed')])
+
+        summary, runs, tasks = self.export('third')
+        self.assertEqual((summary['runs'], summary['tasks'], runs, tasks), (0, 0, [], []))
+
+    def update_run(self, run_id: int, **values):
+        self.engine.execute(Run.__table__.update().where(Run.__table__.c.id == run_id).values(**values))
+
+    def exported_runs(self, **filters) -> list:
+        _, runs, tasks = self.export(f'export-{len(os.listdir(self.folder))}', checkpoint=False, **filters)
+        self.assertEqual(sorted({t['run_id'] for t in tasks}), sorted(r['id'] for r in runs))
+        return sorted(r['name'] for r in runs)
+
+    def test_filters(self):
+        for name, owner, creation in (('early', 'alice', datetime(2018, 1, 1)),
+                                      ('middle', 'bob', datetime(2018, 2, 1)),
+                                      ('late', 'alice', datetime(2018, 3, 1))):
+            self.update_run(self.create_run([{'name': 'test_a'}], name=name), owner=owner, creation=creation)
+
+        self.assertEqual(self.exported_runs(), ['early', 'late', 'middle'])
+        self.assertEqual(self.exported_runs(since=datetime(2018, 2, 1)), ['late', 'middle'])
+        self.assertEqual(self.exported_runs(until=datetime(2018, 2, 1)), ['early'])
+        self.assertEqual(self.exported_runs(since=datetime(2018, 1, 15), until=datetime(2018, 3, 1)), ['middle'])
+        self.assertEqual(self.exported_runs(owner='alice'), ['early', 'late'])
+
+    def test_product_filter(self):
+        self.create_run([{'name': 'test_a'}], name='cli', **{'a01.reserved.product': 'azurecli'})
+        self.create_run([{'name': 'test_a'}], name='sdk', **{'a01.reserved.product': 'azuresdk'})
+        self.create_run([{'name': 'test_a'}], name='none')
+        # the details are free form, a run whose details are not a JSON object has no product
+        self.update_run(self.create_run(name='text'), details='not a json')
+        self.update_run(self.create_run(name='list'), details='["azurecli"]')
+        self.update_run(self.create_run(name='empty'), details=None)
+
+        self.assertEqual(self.exported_runs(product='azurecli'), ['cli'])
+        self.assertEqual(self.exported_runs(product='azuresdk'), ['sdk'])
+        self.assertEqual(self.exported_runs(product='other'), [])
+
+    def test_checkpoint_keeps_filters(self):
+        self.create_run([{'name': 'test_a'}], **{'a01.reserved.product': 'azurecli'})
+        self.export('first', product='azurecli')
+
+        for filters in ({}, {'product': 'azuresdk'}, {'product': 'azurecli', 'owner': 'alice'}):
+            with self.assertRaisesRegex(ValueError, 'filters'):
+                self.export('other', **filters)
+
+        summary, _, _ = self.export('second', product='azurecli')
+        self.assertEqual((summary['runs'], summary['tasks']), (0, 0))
+
+    @unittest.skipIf(pyarrow is None, 'The pyarrow package is not installed.')
+    def test_parquet(self):
+        self.create_run([{'name': 'test_a'}, {'name': 'test_b'}])
+
+        output_dir = os.path.join(self.folder, 'parquet')
+        summary = export(self.engine, output_dir, output_format='parquet')
+        self.assertEqual((summary['runs'], summary['tasks']), (1, 2))
+
+        runs = pyarrow.parquet.read_table(glob.glob(os.path.join(output_dir, 'runs-*.parquet'))[0]).to_pydict()
+        tasks = pyarrow.parquet.read_table(glob.glob(os.path.join(output_dir, 'tasks-*.parquet'))[0]).to_pydict()
+        self.assertEqual(runs['name'], ['run'])
+        self.assertEqual(sorted(tasks['name']), ['test_a', 'test_b'])
+        self.assertEqual(set(tasks['run_id']), set(runs['id']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Verify the lookup of the history of a test across the runs.
+
+    $ cd services/store/app && python -m unittest discover -s ../tests
+"""
+import unittest
+
+from base import StoreTestCase
+
+
+class TestHistory(StoreTestCase):
+    def setUp(self):
+        super(TestHistory, self).setUp()
+        self.run_ids = [self.create_run([{'name': 'test_a', 'annotation': 'suite.a', 'result': result},
+                                         {'name': 'test_b', 'annotation': 'suite.b', 'result': 'Passed'},
+                                         {'name': 'test%_c', 'result': 'Passed'},
+                                         {'name': 'testxyc', 'result': 'Passed'}])
+                        for result in ('Passed', 'Failed', 'Passed')]
+
+    def history(self, query: str) -> list:
+        return [(h['run_id'], h['name'], h['result']) for h in self.request('GET', f'/api/tasks/history?{query}')]
+
+    def test_by_name(self):
+        first, second, third = self.run_ids
+        self.assertEqual(self.history('name=test_a'),
+                         [(third, 'test_a', 'Passed'), (second, 'test_a', 'Failed'), (first, 'test_a', 'Passed')])
+        self.assertEqual(self.history('name=test'), [])
+
+    def test_by_prefix(self):
+        self.assertEqual({name for _, name, _ in self.history('prefix=test_')}, {'test_a', 'test_b'})
+        self.assertEqual(len(self.history('prefix=test')), 12)
+
+    def test_prefix_escapes_wildcards(self):
+        self.assertEqual({name for _, name, _ in self.history('prefix=test%25_')}, {'test%_c'})
+        self.assertEqual(self.history('prefix=test_x'), [])
+
+    def test_by_annotation(self):
+        self.assertEqual({name for _, name, _ in self.history('annotation=suite.b')}, {'test_b'})
+
+    def test_selector_required(self):
+        self.open('GET', '/api/tasks/history', status=400)
+
+    def test_last(self):
+        self.assertEqual([run_id for run_id, _, _ in self.history('name=test_a&last=2')], self.run_ids[:0:-1])
+        self.assertEqual(len(self.history('name=test_a&last=200')), 3)
+        for last in ('0', '201', '-1', 'two'):
+            self.open('GET', f'/api/tasks/history?name=test_a&last={last}', status=400)
+
+    def test_before(self):
+        first, second, third = self.run_ids
+        self.assertEqual([run_id for run_id, _, _ in self.history(f'name=test_a&before={third}')], [second, first])
+        self.assertEqual([run_id for run_id, _, _ in self.history(f'name=test_a&before={second}&last=5')], [first])
+        self.assertEqual(self.history(f'name=test_a&before={first}'), [])
+        for before in ('abc', '', '1.5'):
+            self.open('GET', f'/api/tasks/history?name=test_a&before={before}', status=400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Verify the routing of the queries between the primary database and a read replica. The two databases are separate
+SQLite files, so a query served by the wrong one returns a different run.
+
+    $ cd services/store/app && python -m unittest discover -s ../tests
+"""
+import os
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from base import RUN_DETAILS, StoreTestCase
+from main import LAST_WRITE_HEADER, Run, _config_from_environment, db
+
+
+class TestReadReplica(StoreTestCase):
+    def settings(self) -> dict:
+        return dict(super(TestReadReplica, self).settings(),
+                    A01_DATABASE_READ_URIS=['sqlite:///' + os.path.join(self.folder, 'replica.db')])
+
+    def setUp(self):
+        super(TestReadReplica, self).setUp()
+        with self.app.app_context():
+            replica = db.get_engine(self.app, bind='replica0')
+            db.Model.metadata.create_all(replica)
+            # the replica has not received the runs of the primary yet
+            replica.execute(Run.__table__.insert(), name='replica-only', creation=datetime.utcnow())
+
+    def get_run_names(self, client, headers=None):
+        return [run['name'] for run in self.request('GET', '/api/runs', client=client, headers=headers)]
+
+    def post_run(self, client):
+        return self.open('POST', '/api/run', {'name': 'written', 'details': RUN_DETAILS, 'settings': {}}, client=client)
+
+    def test_get_reads_from_replica(self):
+        self.assertEqual(self.get_run_names(self.app.test_client()), ['replica-only'])
+
+    def test_writer_reads_its_own_writes(self):
+        writer = self.app.test_client()
+        self.post_run(writer)
+
+        self.assertEqual(self.get_run_names(writer), ['written'])
+        self.assertEqual(self.get_run_names(self.app.test_client()), ['replica-only'])
+
+    def test_last_write_header(self):
+        response = self.post_run(self.app.test_client())
+        last_write = response.headers[LAST_WRITE_HEADER]
+
+        self.assertEqual(self.get_run_names(self.app.test_client(), {LAST_WRITE_HEADER: last_write}), ['written'])
+
+    def test_last_write_expires(self):
+        self.post_run(self.app.test_client())
+
+        expired = str(time.time() - self.app.config['A01_DATABASE_READ_STICKY_SECONDS'] - 1)
+        self.assertEqual(self.get_run_names(self.app.test_client(), {LAST_WRITE_HEADER: expired}), ['replica-only'])
+
+    def test_stickiness_disabled(self):
+        self.app.config['A01_DATABASE_READ_STICKY_SECONDS'] = 0
+        writer = self.app.test_client()
+        last_write = self.post_run(writer).headers[LAST_WRITE_HEADER]
+
+        self.assertEqual(self.get_run_names(writer), ['replica-only'])
+        self.assertEqual(self.get_run_names(writer, {LAST_WRITE_HEADER: last_write}), ['replica-only'])
+
+    def test_sticky_seconds_setting(self):
+        for value, expected in (('0', 0), ('30', 30), ('', 10)):
+            with mock.patch.dict(os.environ, {'A01_DATABASE_READ_STICKY_SECONDS': value}):
+                self.assertEqual(_config_from_environment()['A01_DATABASE_READ_STICKY_SECONDS'], expected)
+
+        with mock.patch.dict(os.environ):
+            os.environ.pop('A01_DATABASE_READ_STICKY_SECONDS', None)
+            self.assertEqual(_config_from_environment()['A01_DATABASE_READ_STICKY_SECONDS'], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Verify the revisions stamped on the runs and the tasks, and the listing of the changes since a revision.
+
+    $ cd services/store/app && python -m unittest discover -s ../tests
+
+The revisions are implemented differently on PostgreSQL. Set A01_TEST_POSTGRESQL_URI to a disposable PostgreSQL database
+to run the tests against it. The database is wiped by the tests.
+
+    $ export A01_TEST_POSTGRESQL_URI=postgresql://postgres@localhost:5432/a01test
+"""
+import os
+import unittest
+
+from flask_migrate import Migrate, upgrade
+from sqlalchemy import create_engine, select, text
+
+from base import StoreTestCase
+from main import Task, db
+
+POSTGRESQL_URI = os.environ.get('A01_TEST_POSTGRESQL_URI')
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrations')
+
+
+class TestRevision(StoreTestCase):
+    def test_tasks_changed_since(self):
+        run_id = self.create_run([{'name': 'test_a'}, {'name': 'test_b'}])
+
+        changes = self.request('GET', f'/api/run/{run_id}/tasks?since=0')
+        self.assertEqual(sorted(t['name'] for t in changes['tasks']), ['test_a', 'test_b'])
+        self.assertEqual(changes['revision'], max(t['revision'] for t in changes['tasks']))
+
+        task_id = next(t['id'] for t in changes['tasks'] if t['name'] == 'test_b')
+        patched = self.request('PATCH', f'/api/task/{task_id}', {'status': 'completed', 'result': 'Passed'})
+        self.assertGreater(patched['revision'], changes['revision'])
+
+        delta = self.request('GET', f'/api/run/{run_id}/tasks?since={changes["revision"]}')
+        self.assertEqual([t['name'] for t in delta['tasks']], ['test_b'])
+        self.assertEqual(delta['revision'], patched['revision'])
+
+        self.assertEqual(self.request('GET', f'/api/run/{run_id}/tasks?since={delta["revision"]}'),
+                         {'revision': delta['revision'], 'tasks': []})
+
+    def test_runs_changed_since(self):
+        run_id = self.create_run([{'name': 'test_a'}, {'name': 'test_b'}])
+        revision = self.request('GET', '/api/runs?since=0')['revision']
+
+        self.request('POST', f'/api/run/{run_id}', {'status': 'Completed'})
+
+        delta = self.request('GET', f'/api/runs?since={revision}')
+        self.assertEqual([(r['id'], r['status']) for r in delta['runs']], [(run_id, 'Completed')])
+
+    def test_since_must_be_a_revision(self):
+        run_id = self.create_run([{'name': 'test_a'}])
+        for since in ('abc', '', '1.5'):
+            self.open('GET', f'/api/runs?since={since}', status=400)
+            self.open('GET', f'/api/run/{run_id}/tasks?since={since}', status=400)
+
+
+@unittest.skipUnless(POSTGRESQL_URI, 'A01_TEST_POSTGRESQL_URI is not set.')
+class TestRevisionPostgreSQL(TestRevision):
+    def settings(self) -> dict:
+        return dict(super(TestRevisionPostgreSQL, self).settings(), SQLALCHEMY_DATABASE_URI=POSTGRESQL_URI)
+
+    def setUp(self):
+        self.reset_database()
+        super(TestRevisionPostgreSQL, self).setUp()
+        with self.app.app_context():
+            self.engine = db.get_engine(self.app)
+
+    @staticmethod
+    def reset_database():
+        engine = create_engine(POSTGRESQL_URI)
+        engine.execute('DROP SCHEMA public CASCADE; CREATE SCHEMA public')
+        engine.dispose()
+
+    def task_results(self, tasks: list) -> list:
+        return sorted((t['name'], t['result']) for t in tasks)
+
+    def test_open_transaction_holds_back_revision(self):
+        run_id = self.create_run([{'name': 'test_a'}, {'name': 'test_b'}])
+        task_ids = {t['name']: t['id'] for t in self.request('GET', f'/api/run/{run_id}/tasks')}
+
+        # a write stamped earlier than a committed one is still in flight
+        connection = self.engine.connect()
+        try:
+            transaction = connection.begin()
+            table = Task.__table__
+            connection.execute(table.update().where(table.c.id == task_ids['test_a']).values(result='Failed'))
+            in_flight = connection.execute(select([table.c.revision]).where(table.c.id == task_ids['test_a'])).scalar()
+
+            patched = self.request('PATCH', f'/api/task/{task_ids["test_b"]}', {'result': 'Passed'})
+            self.assertGreater(patched['revision'], in_flight)
+
+            # the committed change is held back with the one in flight, otherwise the latter would be skipped by the
+            # next delta
+            changes = self.request('GET', f'/api/run/{run_id}/tasks?since=0')
+            self.assertLess(changes['revision'], in_flight)
+            self.assertEqual(self.task_results(changes['tasks']), [('test_a', None)])
+
+            transaction.commit()
+        finally:
+            connection.close()
+
+        delta = self.request('GET', f'/api/run/{run_id}/tasks?since={changes["revision"]}')
+        self.assertEqual(self.task_results(delta['tasks']), [('test_a', 'Failed'), ('test_b', 'Passed')])
+        self.assertGreaterEqual(delta['revision'], patched['revision'])
+
+    def test_migration_backfill(self):
+        self.reset_database()
+        Migrate(self.app, db)
+        with self.app.app_context():
+            upgrade(directory=MIGRATIONS, revision='d5e2b9c4a1f7')
+
+        # the rows written before the revision columns were added
+        run_id = self.engine.execute(text("INSERT INTO run (name, creation) VALUES ('legacy', now()) RETURNING id")) \
+            .scalar()
+        self.engine.execute(text("INSERT INTO task (name, run_id, status) VALUES ('test_a', :run_id, 'initialized'), "
+                                 "('test_b', :run_id, 'initialized')"), run_id=run_id)
+
+        with self.app.app_context():
+            upgrade(directory=MIGRATIONS, revision='e7a4c0f9b6d3')
+
+        runs = self.request('GET', '/api/runs?since=0')
+        changes = self.request('GET', f'/api/run/{run_id}/tasks?since=0')
+        self.assertEqual([r['name'] for r in runs['runs']], ['legacy'])
+        self.assertEqual(self.task_results(changes['tasks']), [('test_a', None), ('test_b', None)])
+        backfilled = {r['revision'] for r in runs['runs'] + changes['tasks']}
+        self.assertEqual(len(backfilled), 1)
+        self.assertLessEqual(backfilled.pop(), changes['revision'])
+
+        task_id = next(t['id'] for t in changes['tasks'] if t['name'] == 'test_b')
+        patched = self.request('PATCH', f'/api/task/{task_id}', {'result': 'Passed'})
+        self.assertGreater(patched['revision'], changes['revision'])
+
+        delta = self.request('GET', f'/api/run/{run_id}/tasks?since={changes["revision"]}')
+        self.assertEqual(self.task_results(delta['tasks']), [('test_b', 'Passed')])
+
+
+if __name__ == '__main__':
+    unittest.main()